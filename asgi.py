@@ -0,0 +1,3 @@
+from flasksite.asgi import app
+
+# gunicorn asgi:app -k uvicorn.workers.UvicornWorker
@@ -0,0 +1,47 @@
+import argparse
+import json
+import sys
+
+# Compares two loadtest.py reports run for run and exits with 1 if the new one is slower
+# than the allowed tolerance, so it can gate a CI job.
+
+
+def key(run):
+    return run['worker_class'], run['workers'], run['threads'], run['concurrency']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two benchmark reports')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='allowed relative regression')
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = {key(run): run for run in json.load(f)['runs']}
+    with open(args.candidate) as f:
+        candidate = json.load(f)['runs']
+
+    regressions = 0
+    for run in candidate:
+        old = baseline.get(key(run))
+        if old is None:
+            continue
+        checks = [('throughput', old['throughput'], run['throughput'], False),
+                  ('p50', old['latency']['p50'], run['latency']['p50'], True),
+                  ('p99', old['latency']['p99'], run['latency']['p99'], True),
+                  ('max rss', max(old['worker_rss_kb'], default=0), max(run['worker_rss_kb'], default=0), True)]
+        label = '{} x{} threads={} c={}'.format(*key(run))
+        for name, before, after, lower_is_better in checks:
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            regressed = change > args.tolerance if lower_is_better else change < -args.tolerance
+            regressions += regressed
+            print(f"{label:<32} {name:<10} {before:>12.4f} -> {after:>12.4f} {change:+7.1%}"
+                  f"{'  REGRESSION' if regressed else ''}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+import argparse
+import http.client
+import importlib.util
+import json
+import math
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from urllib.parse import urlencode
+
+# End-to-end load test: seeds a local SQLite database, starts `gunicorn app:app` (as in
+# the Procfile) with each requested worker class and drives a weighted mix of requests
+# against it. Results are written as JSON so runs on different commits can be compared
+# with benchmarks/compare.py.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_IMAGE = os.path.join(ROOT, 'flasksite', 'static', 'other_pics', 'alex.jpg')
+SUDOKU = '530070000600195000098000060800060003400803001700020006060000280000419005000080079'
+DEFAULT_MIX = 'blog=30,post=30,api_posts_all=10,api_posts_last=10,api_posts_new=5,solve_sudoku=10,emoclassifier=5'
+
+
+def multipart_body(field, filename, data):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    return body, {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+
+
+class Scenario:
+
+    def __init__(self, manifest, image):
+        self.tokens = manifest['tokens']
+        self.post_ids = manifest['post_ids']
+        self.pages = max(1, len(self.post_ids) // 5)
+        with open(image, 'rb') as f:
+            self.upload = multipart_body('image', os.path.basename(image), f.read())
+
+    def build(self, name, rng):
+        token = rng.choice(self.tokens)
+        if name == 'blog':
+            return 'GET', f'/blog?page={rng.randint(1, self.pages)}', None, {}
+        if name == 'post':
+            return 'GET', f'/post/{rng.choice(self.post_ids)}', None, {}
+        if name == 'api_posts_all':
+            return 'GET', '/api/posts/all?' + urlencode({'token': token}), None, {}
+        if name == 'api_posts_last':
+            return 'GET', '/api/posts/last?' + urlencode({'token': token}), None, {}
+        if name == 'api_posts_new':
+            query = urlencode({'token': token, 'title': 'Load test', 'content': uuid.uuid4().hex})
+            return 'POST', '/api/posts/new?' + query, None, {}
+        if name == 'solve_sudoku':
+            return 'POST', '/api/solve_sudoku?' + urlencode({'token': token, 'position': SUDOKU}), None, {}
+        if name == 'emoclassifier':
+            body, headers = self.upload
+            return 'POST', '/api/emoclassifier?' + urlencode({'token': token}), body, headers
+        raise ValueError(f'Unknown request type: {name}')
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(','):
+        name, weight = item.split('=')
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = max(0, math.ceil(p / 100 * len(sorted_values)) - 1) # nearest rank
+    return sorted_values[k]
+
+
+def latency_summary(latencies):
+    values = sorted(latencies)
+    return {'count': len(values),
+            'mean': sum(values) / len(values) if values else None,
+            'p50': percentile(values, 50), 'p90': percentile(values, 90),
+            'p95': percentile(values, 95), 'p99': percentile(values, 99),
+            'max': values[-1] if values else None}
+
+
+def send(port, method, path, body=None, headers=None, timeout=120):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+######## Process helpers (Linux /proc)
+
+def child_pids(pid):
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        if int(stat.rsplit(')', 1)[1].split()[1]) == pid: # ppid is the 2nd field after "(comm)"
+            children.append(int(entry))
+    return children
+
+
+def rss_kb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class RssSampler(threading.Thread):
+
+    def __init__(self, master_pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.interval = interval
+        self.peak = {}
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            for pid in child_pids(self.master_pid):
+                rss = rss_kb(pid)
+                if rss is not None:
+                    self.peak[pid] = max(rss, self.peak.get(pid, 0))
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+######## Server lifecycle
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(worker_class, workers, threads, port, env, extra_args=(), app_module='app:app'):
+    cmd = [sys.executable, '-m', 'gunicorn', app_module, '-k', worker_class, '-w', str(workers),
+           '-b', f'127.0.0.1:{port}', '--timeout', '300', *extra_args]
+    if worker_class == 'gthread':
+        cmd += ['--threads', str(threads)]
+    server = subprocess.Popen(cmd, cwd=ROOT, env=env) # cwd matters: the ML routes use ./flasksite/... paths
+    deadline = time.time() + 120 # workers import TensorFlow, which takes a while
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with code {server.returncode}')
+        try:
+            send(port, 'GET', '/', timeout=5)
+            return server
+        except OSError:
+            time.sleep(0.5)
+    stop_gunicorn(server)
+    raise RuntimeError('gunicorn did not start in time')
+
+
+def stop_gunicorn(server):
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+######## Load generation
+
+def drive(port, scenario, weights, concurrency, duration, seed=0):
+    names = list(weights)
+    cum_weights = [sum(weights[n] for n in names[:i + 1]) for i in range(len(names))]
+    results = defaultdict(list) # name -> [(latency, ok)]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(i):
+        rng = random.Random(seed + i)
+        local = defaultdict(list)
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, cum_weights=cum_weights)[0]
+            method, path, body, headers = scenario.build(name, rng)
+            start = time.perf_counter()
+            try:
+                ok = send(port, method, path, body, headers) < 500
+            except OSError:
+                ok = False
+            local[name].append((time.perf_counter() - start, ok))
+        with lock:
+            for name, samples in local.items():
+                results[name].extend(samples)
+
+    clients = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for t in clients:
+        t.start()
+    for t in clients:
+        t.join()
+    return results, time.perf_counter() - started
+
+
+def summarize(results, elapsed):
+    all_samples = [s for samples in results.values() for s in samples]
+    summary = {'requests': len(all_samples),
+               'errors': sum(1 for _, ok in all_samples if not ok),
+               'throughput': len(all_samples) / elapsed if elapsed else 0.0,
+               'latency': latency_summary([lat for lat, _ in all_samples]),
+               'per_route': {}}
+    for name, samples in sorted(results.items()):
+        route = latency_summary([lat for lat, _ in samples])
+        route['errors'] = sum(1 for _, ok in samples if not ok)
+        summary['per_route'][name] = route
+    return summary
+
+
+def run_one(args, worker_class, concurrency, scenario, weights, env):
+    reset_database(args)
+    port = free_port()
+    server = start_gunicorn(worker_class, args.workers, args.threads, port, env)
+    sampler = RssSampler(server.pid)
+    try:
+        if args.warmup:
+            drive(port, scenario, weights, concurrency, args.warmup, seed=10_000)
+        sampler.start()
+        results, elapsed = drive(port, scenario, weights, concurrency, args.duration)
+    finally:
+        if sampler.is_alive():
+            sampler.stop()
+        stop_gunicorn(server)
+    summary = summarize(results, elapsed)
+    summary.update({'worker_class': worker_class, 'workers': args.workers,
+                    'threads': args.threads if worker_class == 'gthread' else None,
+                    'concurrency': concurrency, 'duration': elapsed,
+                    'worker_rss_kb': sorted(sampler.peak.values())})
+    return summary
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def reset_database(args):
+    # The runs create posts and predictions; every run starts again from the seeded data, so
+    # that later worker classes and concurrency levels don't query a bigger dataset
+    shutil.copyfile(os.path.join(args.workdir, 'seed.db'), os.path.join(args.workdir, 'bench.db'))
+
+
+def prepare(args):
+    workdir = args.workdir = args.workdir or tempfile.mkdtemp(prefix='flasksite-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    manifest_path = os.path.join(workdir, 'manifest.json')
+    if not args.reuse_db or not os.path.exists(manifest_path):
+        subprocess.check_call([sys.executable, os.path.join(ROOT, 'benchmarks', 'seed.py'),
+                               os.path.join(workdir, 'seed.db'), '--manifest', manifest_path, '--users', str(args.users),
+                               '--posts', str(args.posts), '--predictions', str(args.predictions)])
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    reset_database(args)
+
+    env = dict(os.environ)
+    env['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    env.setdefault('SECRET_KEY', 'benchmark')
+    env['PROMETHEUS_MULTIPROC_DIR'] = os.path.join(workdir, 'metrics')
+    return manifest, env
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the Flask app under gunicorn')
+    parser.add_argument('--worker-class', nargs='+', default=['sync', 'gthread', 'gevent'])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4, help='threads per worker for gthread')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of measured load per run')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds of unmeasured load per run')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='comma separated name=weight pairs')
+    parser.add_argument('--image', default=DEFAULT_IMAGE, help='image uploaded to /api/emoclassifier')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--posts', type=int, default=1000)
+    parser.add_argument('--predictions', type=int, default=1000)
+    parser.add_argument('--workdir', help='directory for the database (default: a new temp dir)')
+    parser.add_argument('--reuse-db', action='store_true', help='keep an already seeded database in --workdir')
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    manifest, env = prepare(args)
+    scenario = Scenario(manifest, args.image)
+
+    runs = []
+    for worker_class in args.worker_class:
+        if worker_class == 'gevent' and importlib.util.find_spec('gevent') is None:
+            print('Skipping gevent: it is not installed (pip install -r benchmarks/requirements.txt)')
+            continue
+        for concurrency in args.concurrency:
+            print(f'{worker_class} x{args.workers}, {concurrency} clients ...', flush=True)
+            run = run_one(args, worker_class, concurrency, scenario, weights, env)
+            print(f"  {run['throughput']:.1f} req/s, p50 {run['latency']['p50']}, "
+                  f"p99 {run['latency']['p99']}, errors {run['errors']}", flush=True)
+            runs.append(run)
+
+    report = {'commit': git_commit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'config': {k: v for k, v in vars(args).items() if k not in ('output', 'workdir', 'reuse_db')},
+              'runs': runs}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import argparse
+import json
+import os
+import random
+import sys
+
+# Seeds a throwaway SQLite database for the load tests. Runs in its own process because
+# flasksite reads DATABASE_URL when it is imported.
+
+
+def seed(users, posts, predictions, seed_value=0):
+    from flasksite import db, bcrypt
+    from flasksite.models import User, Post, API_Key, EmotionPrediction
+    from flasksite.utils import generate_api_key
+
+    rng = random.Random(seed_value)
+    db.drop_all()
+    db.create_all()
+
+    password = bcrypt.generate_password_hash('benchmark').decode('utf-8') # hashing is slow, share one hash
+    user_rows = [User(username=f'user{i}', email=f'user{i}@bench.local', password=password)
+                 for i in range(users)]
+    db.session.add_all(user_rows)
+    db.session.flush()
+
+    tokens = []
+    for user in user_rows:
+        key = API_Key(key=generate_api_key(), keyowner=user)
+        db.session.add(key)
+        tokens.append(key.key)
+
+    for i in range(posts):
+        db.session.add(Post(title=f'Benchmark post {i}',
+                            content=' '.join(rng.choice(['lorem', 'ipsum', 'dolor', 'sit', 'amet'])
+                                             for _ in range(rng.randint(20, 200))),
+                            author=rng.choice(user_rows)))
+
+    emotions = ["angry", "disgust", "scared", "happy", "sad", "surprised", "neutral"]
+    for _ in range(predictions):
+        db.session.add(EmotionPrediction(image_file='default.jpg', emotion_class=rng.choice(emotions),
+                                         uploader=rng.choice(user_rows)))
+    db.session.commit()
+
+    return {'tokens': tokens, 'post_ids': [post_id for (post_id,) in db.session.query(Post.id)]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed a SQLite database with synthetic benchmark data')
+    parser.add_argument('database', help='path of the SQLite file to (re)create')
+    parser.add_argument('--manifest', required=True, help='where to write the tokens and post ids as JSON')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--posts', type=int, default=1000)
+    parser.add_argument('--predictions', type=int, default=1000)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(args.database)
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    manifest = seed(args.users, args.posts, args.predictions)
+    with open(args.manifest, 'w') as f:
+        json.dump(manifest, f)
+
+
+if __name__ == '__main__':
+    main()
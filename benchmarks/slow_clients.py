@@ -0,0 +1,133 @@
+import argparse
+import json
+import math
+import os
+import socket
+import threading
+import time
+from urllib.parse import urlencode
+
+from loadtest import (DEFAULT_IMAGE, multipart_body, latency_summary, send, free_port,
+                      start_gunicorn, stop_gunicorn, prepare, reset_database, git_commit)
+
+# How many clients slowly uploading an image to /api/emoclassifier a single worker can hold
+# while it still answers other requests within the SLO. Compares the sync worker
+# (Procfile), gthread and the ASGI app under uvicorn workers.
+
+MODES = {
+    'sync': ('app:app', 'sync'),
+    'gthread': ('app:app', 'gthread'),
+    'async': ('asgi:app', 'uvicorn.workers.UvicornWorker'),
+}
+
+
+def slow_upload(port, path, body, headers, seconds, chunks=20):
+    sock = socket.create_connection(('127.0.0.1', port), timeout=seconds + 120)
+    try:
+        head = (f'POST {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n'
+                f'Content-Length: {len(body)}\r\n' + ''.join(f'{k}: {v}\r\n' for k, v in headers.items()) + '\r\n')
+        sock.sendall(head.encode())
+        step = math.ceil(len(body) / chunks)
+        for i in range(0, len(body), step):
+            sock.sendall(body[i:i + step])
+            time.sleep(seconds / chunks)
+        response = b''
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            response += data
+        return int(response.split(b' ', 2)[1]) if response else None
+    except (OSError, ValueError, IndexError):
+        return None
+    finally:
+        sock.close()
+
+
+def run_level(port, clients, token, upload, args):
+    statuses = []
+    path = '/api/emoclassifier?' + urlencode({'token': token})
+    body, headers = upload
+
+    def uploader():
+        statuses.append(slow_upload(port, path, body, headers, args.upload_seconds))
+
+    uploaders = [threading.Thread(target=uploader) for _ in range(clients)]
+    for t in uploaders:
+        t.start()
+    time.sleep(1) # let the uploads connect before probing
+
+    probe_path = '/api/posts/last?' + urlencode({'token': token})
+    latencies, failures = [], 0
+    deadline = time.perf_counter() + max(1.0, args.upload_seconds - 2)
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            ok = send(port, 'GET', probe_path, timeout=args.slo * 5) < 500
+        except OSError:
+            ok = False
+        latencies.append(time.perf_counter() - start)
+        failures += not ok
+        time.sleep(0.05)
+
+    for t in uploaders:
+        t.join()
+    probe = latency_summary(latencies)
+    uploads_ok = sum(1 for status in statuses if status == 200)
+    return {'clients': clients, 'probe': probe, 'probe_failures': failures, 'uploads_ok': uploads_ok,
+            'within_slo': failures == 0 and uploads_ok == clients and probe['p95'] <= args.slo}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Slow upload capacity of the sync and async serving modes')
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument('--workers', type=int, default=1, help='one worker per core being measured')
+    parser.add_argument('--threads', type=int, default=4, help='threads per worker for gthread')
+    parser.add_argument('--upload-seconds', type=float, default=10, help='how long each upload trickles')
+    parser.add_argument('--slo', type=float, default=1.0, help='p95 latency allowed for the probe requests')
+    parser.add_argument('--image', default=DEFAULT_IMAGE)
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--posts', type=int, default=100)
+    parser.add_argument('--predictions', type=int, default=0)
+    parser.add_argument('--workdir')
+    parser.add_argument('--reuse-db', action='store_true')
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    manifest, env = prepare(args)
+    token = manifest['tokens'][0]
+    with open(args.image, 'rb') as f:
+        upload = multipart_body('image', os.path.basename(args.image), f.read())
+
+    report = {'commit': git_commit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'cpu_count': os.cpu_count(), 'config': {k: v for k, v in vars(args).items() if k != 'output'},
+              'modes': []}
+    for mode in args.modes:
+        app_module, worker_class = MODES[mode]
+        reset_database(args)
+        port = free_port()
+        server = start_gunicorn(worker_class, args.workers, args.threads, port, env, app_module=app_module)
+        levels = []
+        try:
+            for clients in sorted(args.clients):
+                level = run_level(port, clients, token, upload, args)
+                levels.append(level)
+                print(f"{mode}: {clients} slow uploads -> probe p95 {level['probe']['p95']}, "
+                      f"uploads ok {level['uploads_ok']}/{clients}", flush=True)
+                if not level['within_slo']:
+                    break
+        finally:
+            stop_gunicorn(server)
+        max_clients = max([lvl['clients'] for lvl in levels if lvl['within_slo']], default=0)
+        report['modes'].append({'mode': mode, 'workers': args.workers, 'max_clients': max_clients,
+                                'max_clients_per_worker': max_clients / args.workers, 'levels': levels})
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    for mode in report['modes']:
+        print(f"{mode['mode']:<8} {mode['max_clients_per_worker']:.0f} slow clients per worker within the SLO")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import argparse
+import json
+import os
+import threading
+import time
+from urllib.parse import urlencode
+
+from loadtest import (DEFAULT_IMAGE, multipart_body, send, free_port, child_pids,
+                      start_gunicorn, stop_gunicorn, prepare, reset_database, git_commit)
+
+# Per-worker memory with and without ML_PRELOAD (see gunicorn.conf.py) for 1, 4 and 16
+# workers. Every worker first serves some /api/emoclassifier requests so that it has its
+# model loaded; then the unique (private) and proportional set sizes are read from
+# /proc/<pid>/smaps_rollup. Unique memory is what each additional worker costs.
+
+
+def smaps_rollup(pid):
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {'rss_kb': fields.get('Rss', 0), 'pss_kb': fields.get('Pss', 0),
+            'uss_kb': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)}
+
+
+def served_by(access_log):
+    # PIDs of the workers that answered an upload with 200, i.e. that have loaded the model
+    pids = set()
+    if not os.path.exists(access_log):
+        return pids
+    with open(access_log) as f:
+        for line in f:
+            pid, path, status = line.split()
+            if path == '/api/emoclassifier' and status == '200':
+                pids.add(int(pid.strip('<>')))
+    return pids
+
+
+def warm_up(port, token, upload, requests, access_log, workers, max_rounds):
+    path = '/api/emoclassifier?' + urlencode({'token': token})
+    body, headers = upload
+    # Many requests in parallel to spread them over the workers. Which worker accepts a
+    # connection is up to the kernel, so repeat until the access log shows every worker
+    # has served one: a worker that never loaded the model would report a much smaller USS.
+    for _ in range(max_rounds):
+        threads = [threading.Thread(target=send, args=(port, 'POST', path, body, headers)) for _ in range(requests)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        warm = served_by(access_log) & set(workers)
+        if warm == set(workers):
+            break
+    return warm
+
+
+def measure(args, env, preload, workers, token, upload):
+    reset_database(args)
+    env = dict(env, ML_PRELOAD='1' if preload else '0')
+    port = free_port()
+    access_log = os.path.join(args.workdir, f'access-{workers}-{int(preload)}.log')
+    if os.path.exists(access_log):
+        os.remove(access_log)
+    server = start_gunicorn('sync', workers, 1, port, env,
+                            extra_args=['--access-logfile', access_log, '--access-logformat', '%(p)s %(U)s %(s)s'])
+    try:
+        deadline = time.time() + 120
+        while len(child_pids(server.pid)) < workers and time.time() < deadline:
+            time.sleep(0.5)
+        pids = child_pids(server.pid)
+        warm = warm_up(port, token, upload, workers * args.requests_per_worker, access_log, pids, args.max_rounds)
+        time.sleep(1)
+        per_worker = [dict(smaps_rollup(pid), pid=pid, warm=pid in warm) for pid in pids]
+        master = smaps_rollup(server.pid)
+    finally:
+        stop_gunicorn(server)
+    # Averages only over the workers that loaded the model; cold ones are kept in per_worker
+    uss = [w['uss_kb'] for w in per_worker if w['warm']]
+    return {'preload': preload, 'workers': workers, 'warm_workers': len(uss), 'master': master,
+            'per_worker': per_worker,
+            'mean_uss_kb': sum(uss) / len(uss) if uss else None, 'max_uss_kb': max(uss, default=None),
+            'total_pss_kb': master['pss_kb'] + sum(w['pss_kb'] for w in per_worker)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-worker memory with and without ML_PRELOAD')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--requests-per-worker', type=int, default=4)
+    parser.add_argument('--max-rounds', type=int, default=10, help='warm-up rounds before giving up on cold workers')
+    parser.add_argument('--image', default=DEFAULT_IMAGE)
+    parser.add_argument('--users', type=int, default=1)
+    parser.add_argument('--posts', type=int, default=0)
+    parser.add_argument('--predictions', type=int, default=0)
+    parser.add_argument('--workdir')
+    parser.add_argument('--reuse-db', action='store_true')
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    manifest, env = prepare(args)
+    token = manifest['tokens'][0]
+    with open(args.image, 'rb') as f:
+        upload = multipart_body('image', os.path.basename(args.image), f.read())
+
+    runs = []
+    for workers in args.workers:
+        for preload in (False, True):
+            run = measure(args, env, preload, workers, token, upload)
+            print(f"{workers:>3} workers ({run['warm_workers']} warm), preload={'on ' if preload else 'off'}: "
+                  f"unique {run['mean_uss_kb'] / 1024:.1f} MB/worker, "
+                  f"total PSS {run['total_pss_kb'] / 1024:.1f} MB", flush=True)
+            runs.append(run)
+
+    with open(args.output, 'w') as f:
+        json.dump({'commit': git_commit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'config': {k: v for k, v in vars(args).items() if k != 'output'}, 'runs': runs}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,28 @@ app.config['MAIL_USERNAME'] = os.environ.get('EMAIL_USER')
 app.config['MAIL_PASSWORD'] = os.environ.get('EMAIL_PASS')
 app.config['MAIL_USE_TLS'] = True
 app.config['KERAS_BACKEND'] = os.environ.get('KERAS_BACKEND')
+app.config['ML_PRELOAD'] = os.environ.get('ML_PRELOAD') == '1'
+app.config['INFERENCE_THREADS'] = int(os.environ.get('INFERENCE_THREADS', 1))
+app.config['SOLVER_PROCESSES'] = int(os.environ.get('SOLVER_PROCESSES', 1))
+app.config['MAIL_THREADS'] = int(os.environ.get('MAIL_THREADS', 2))
+app.config['WRITE_BEHIND_MODE'] = os.environ.get('WRITE_BEHIND_MODE', 'buffered') # or 'sync'
+app.config['WRITE_BEHIND_MAX_ROWS'] = int(os.environ.get('WRITE_BEHIND_MAX_ROWS', 100))
+app.config['WRITE_BEHIND_FLUSH_INTERVAL'] = float(os.environ.get('WRITE_BEHIND_FLUSH_INTERVAL', 1.0))
+app.config['PROFILING_ENABLED'] = os.environ.get('PROFILING_ENABLED') == '1'
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+app.config['PROFILE_TOKEN'] = os.environ.get('PROFILE_TOKEN')
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', 'profiles')
+app.config['PROFILE_N_PLUS_ONE_THRESHOLD'] = int(os.environ.get('PROFILE_N_PLUS_ONE_THRESHOLD', 3))
+
+# SQLite (local runs and benchmarks) does not take the QueuePool options
+if not (app.config['SQLALCHEMY_DATABASE_URI'] or '').startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,
+    }
 
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
@@ -27,4 +49,6 @@ API_DOCUMENTATION_LINK = 'https://documenter.getpostman.com/view/11985382/T1LFmV
 
 graph = tf.get_default_graph() # https://kobkrit.com/tensor-something-is-not-an-element-of-this-graph-error-in-keras-on-flask-web-server-4173a8fe15e1
 
+from flasksite import metrics
+from flasksite import profiling
 from flasksite import routes
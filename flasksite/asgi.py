@@ -0,0 +1,118 @@
+import asyncio
+import contextlib
+import functools
+import os
+import signal
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import HTMLResponse
+from starlette.routing import Route, Mount
+from werkzeug.datastructures import FileStorage
+from flasksite import app as flask_app, graph
+from flasksite.models import EmotionPrediction
+from flasksite.ml_model.image import predict_emotion
+from flasksite.utils import save_picture, authenticate_api_token
+from flasksite.metrics import time_stage, track_request
+from flasksite.executors import inference_executor, solver_executor, shutdown_executors
+from flasksite.write_behind import write_behind
+from flasksite.sudoku.sudoku_solver import solve_sudoku, check_position, format_solution
+
+# ASGI entry point (see asgi.py at the top level). The API routes that upload images or
+# burn CPU are served natively here: uploads are read without holding a thread, and the
+# inference and the solver run on bounded executors. Everything else is the regular
+# Flask app, run in a thread pool by a2wsgi.
+
+
+######## Blocking helpers, run off the event loop
+
+def authenticate(token):
+    with flask_app.app_context():
+        return authenticate_api_token(token)
+
+
+def run_prediction(picture_fn):
+    with graph.as_default():
+        return predict_emotion(os.path.join('./flasksite/static/ml_pics', picture_fn))
+
+
+def tracked(endpoint):
+    # Request metrics under the endpoint names of the equivalent Flask views, so that
+    # /metrics shows the same series whichever way the app is served
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request):
+            with track_request(request.method, endpoint) as stats:
+                response = await view(request)
+                stats['status'] = response.status_code
+            return response
+        return wrapper
+    return decorator
+
+
+######## Endpoints
+
+@tracked('emoclassifierAPI')
+async def emoclassifier(request):
+    author_id, error = await run_in_threadpool(authenticate, request.query_params.get('token'))
+    if error:
+        return HTMLResponse(error)
+
+    loop = asyncio.get_running_loop()
+    try:
+        form = await request.form() # streamed into a spooled temp file, no thread is blocked on a slow client
+        image = form['image']
+        picture_fn = await run_in_threadpool(save_picture, FileStorage(image.file, filename=image.filename),
+                                             folder='ml_pics')
+        pred = await loop.run_in_executor(inference_executor, run_prediction, picture_fn)
+    except Exception:
+        return HTMLResponse('You need to attach an image with a query')
+
+    await run_in_threadpool(write_behind.add, EmotionPrediction, image_file=picture_fn, emotion_class=pred,
+                            user_id=author_id, date_uploaded=datetime.utcnow())
+    return HTMLResponse(pred)
+
+
+@tracked('api_solve_sudoku')
+async def api_solve_sudoku(request):
+    author_id, error = await run_in_threadpool(authenticate, request.query_params.get('token'))
+    if error:
+        return HTMLResponse(error)
+
+    position = request.query_params.get('position')
+    error = check_position(position)
+    if error:
+        return HTMLResponse(error)
+
+    loop = asyncio.get_running_loop()
+    with time_stage('sudoku_solve'):
+        try:
+            res = await loop.run_in_executor(solver_executor(), solve_sudoku, position)
+        except BrokenProcessPool:
+            # A solver process died (OOM, crash). Forking a new pool from this worker, which
+            # now runs threads, isn't safe, so ask gunicorn for a fresh worker instead:
+            # SIGTERM makes the uvicorn worker finish its requests and exit.
+            flask_app.logger.error('Sudoku solver pool is broken, restarting worker %d', os.getpid())
+            os.kill(os.getpid(), signal.SIGTERM)
+            return HTMLResponse('The solver is restarting, please try again', status_code=503)
+    return HTMLResponse(format_solution(res))
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    # Both block (joins, a last insert), so keep them off the event loop
+    await run_in_threadpool(shutdown_executors) # let queued inferences and emails finish before the worker exits
+    await run_in_threadpool(write_behind.close)
+
+
+app = Starlette(
+    routes=[
+        Route('/api/emoclassifier', emoclassifier, methods=['POST']),
+        Route('/api/solve_sudoku', api_solve_sudoku, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(flask_app, workers=int(os.environ.get('WSGI_THREADS', 10)))),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,41 @@
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from flasksite import app
+
+# Bounded pools for work that should not run on a request thread or on the event loop
+# of the ASGI app. Threads are only started on first use, so creating the pools here
+# is safe before gunicorn forks its workers.
+inference_executor = ThreadPoolExecutor(max_workers=app.config['INFERENCE_THREADS'], thread_name_prefix='inference')
+mail_executor = ThreadPoolExecutor(max_workers=app.config['MAIL_THREADS'], thread_name_prefix='mail')
+
+_solver_executor = None
+
+
+def solver_executor():
+    # Sudoku.solve is pure Python and holds the GIL, so it gets processes rather than threads.
+    # Created per gunicorn worker instead of being inherited from the master; see start_solver_executor.
+    global _solver_executor
+    if _solver_executor is None:
+        processes = app.config['SOLVER_PROCESSES']
+        if processes > 0:
+            _solver_executor = ProcessPoolExecutor(max_workers=processes,
+                                                   mp_context=multiprocessing.get_context('fork'))
+        else:
+            _solver_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='solver')
+    return _solver_executor
+
+
+def start_solver_executor():
+    # Called from gunicorn's post_worker_init hook, before the worker runs its event loop and
+    # thread pools: a fork-context pool forks all of its processes on the first submit, and
+    # forking while other threads hold locks can deadlock the children.
+    solver_executor().submit(int).result()
+
+
+def shutdown_executors():
+    global _solver_executor
+    inference_executor.shutdown(wait=True)
+    mail_executor.shutdown(wait=True)
+    if _solver_executor is not None:
+        _solver_executor.shutdown(wait=True)
+        _solver_executor = None
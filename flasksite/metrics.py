@@ -0,0 +1,120 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import request, g, Response, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from prometheus_client import (Counter, Gauge, Histogram, CollectorRegistry, REGISTRY,
+                               CONTENT_TYPE_LATEST, generate_latest, multiprocess)
+from flasksite import app
+
+# Set by gunicorn.conf.py so that every worker writes to the same directory
+# and /metrics can aggregate them, whichever worker serves the scrape.
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+REQUEST_LATENCY = Histogram('flasksite_request_duration_seconds', 'Request latency per endpoint',
+                            ['method', 'endpoint'])
+REQUEST_COUNT = Counter('flasksite_requests_total', 'Requests per endpoint and status code',
+                        ['method', 'endpoint', 'status'])
+IN_FLIGHT = Gauge('flasksite_requests_in_flight', 'Requests currently being served',
+                  ['endpoint'], multiprocess_mode='livesum')
+STAGE_LATENCY = Histogram('flasksite_stage_duration_seconds', 'Latency of the ML and sudoku pipeline stages',
+                          ['stage'])
+DB_QUERIES = Histogram('flasksite_request_db_queries', 'Number of DB queries issued per request',
+                       ['endpoint'], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+DB_TIME = Histogram('flasksite_request_db_duration_seconds', 'Time spent in DB queries per request',
+                    ['endpoint'])
+
+
+# Per-request DB stats for requests served outside Flask (the ASGI endpoints). A ContextVar
+# rather than flask.g, because it follows the request into run_in_threadpool.
+_db_stats = ContextVar('db_stats', default=None)
+
+
+@contextmanager
+def time_stage(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - start)
+
+
+def _endpoint():
+    return request.endpoint or 'unmatched' # 404s have no endpoint; keep the label set bounded
+
+
+@contextmanager
+def track_request(method, endpoint):
+    # Records the same series as the Flask hooks below; set stats['status'] before leaving
+    stats = {'status': 500, 'db_queries': 0, 'db_time': 0.0}
+    token = _db_stats.set(stats)
+    IN_FLIGHT.labels(endpoint).inc()
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        _db_stats.reset(token)
+        REQUEST_LATENCY.labels(method, endpoint).observe(time.perf_counter() - start)
+        REQUEST_COUNT.labels(method, endpoint, stats['status']).inc()
+        IN_FLIGHT.labels(endpoint).dec()
+        DB_QUERIES.labels(endpoint).observe(stats['db_queries'])
+        DB_TIME.labels(endpoint).observe(stats['db_time'])
+
+
+@app.before_request
+def start_request_timer():
+    if request.endpoint == 'metrics':
+        return
+    g._metrics_start = time.perf_counter()
+    g._metrics_db_queries = 0
+    g._metrics_db_time = 0.0
+    IN_FLIGHT.labels(_endpoint()).inc()
+
+
+@app.after_request
+def record_status(response):
+    g._metrics_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def observe_request(exc):
+    start = g.pop('_metrics_start', None)
+    if start is None:
+        return
+    endpoint = _endpoint()
+    status = g.pop('_metrics_status', 500) # after_request is skipped on unhandled exceptions
+    REQUEST_LATENCY.labels(request.method, endpoint).observe(time.perf_counter() - start)
+    REQUEST_COUNT.labels(request.method, endpoint, status).inc()
+    IN_FLIGHT.labels(endpoint).dec()
+    DB_QUERIES.labels(endpoint).observe(g._metrics_db_queries)
+    DB_TIME.labels(endpoint).observe(g._metrics_db_time)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def observe_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['metrics_query_start'].pop()
+    stats = _db_stats.get()
+    if stats is not None:
+        stats['db_queries'] += 1
+        stats['db_time'] += elapsed
+    elif has_request_context() and '_metrics_start' in g:
+        g._metrics_db_queries += 1
+        g._metrics_db_time += elapsed
+
+
+@app.route("/metrics")
+def metrics():
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
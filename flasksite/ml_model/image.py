@@ -1,23 +1,60 @@
-from flasksite import app
+from flasksite import app, graph
+from flasksite.metrics import time_stage
 import os
+import threading
 from PIL import Image
 from keras.preprocessing.image import img_to_array
 from keras.models import load_model
 import cv2
 import numpy as np
 
+EMOTIONS = ["angry","disgust","scared", "happy", "sad", "surprised","neutral"]
+
+detection_model_path = os.path.join(app.root_path, 'ml_model/haarcascades','haarcascade_frontalface_default.xml')
+emotion_model_path =  os.path.join(app.root_path, 'ml_model/models','mini_XCEPTION_AffectNet_stratified_with_loss_.60-0.70.hdf5')
+
+# Loaded once instead of on every prediction. With ML_PRELOAD=1 gunicorn loads the app in
+# the master (preload_app in gunicorn.conf.py), so TensorFlow, Keras and OpenCV are loaded
+# before the fork and shared copy-on-write by all workers.
+# The Keras model itself is still built in each worker, on first use: TensorFlow's thread
+# pools don't survive a fork, and the weights are under 1MB next to the runtime.
+# detectMultiScale keeps per-image state in the classifier, so every thread (gthread
+# workers, the ASGI inference executor, a2wsgi threads) gets its own cascade.
+_face_detection = threading.local()
+_emotion_classifier = None
+_emotion_classifier_pid = None
+_lock = threading.Lock()
+
+
+def get_face_detection():
+    cascade = getattr(_face_detection, 'cascade', None)
+    if cascade is None:
+        with time_stage('load_model'):
+            cascade = _face_detection.cascade = cv2.CascadeClassifier(detection_model_path)
+    return cascade
 
-def predict_emotion(img_path):
 
-    detection_model_path = os.path.join(app.root_path, 'ml_model/haarcascades','haarcascade_frontalface_default.xml')
-    emotion_model_path =  os.path.join(app.root_path, 'ml_model/models','mini_XCEPTION_AffectNet_stratified_with_loss_.60-0.70.hdf5')
+def get_emotion_classifier():
+    global _emotion_classifier, _emotion_classifier_pid
+    if _emotion_classifier_pid != os.getpid():
+        with _lock:
+            if _emotion_classifier_pid != os.getpid():
+                with time_stage('load_model'), graph.as_default():
+                    _emotion_classifier = load_model(emotion_model_path, compile=False)
+                    if hasattr(_emotion_classifier, '_make_predict_function'):
+                        _emotion_classifier._make_predict_function() # needed to predict from other threads
+                _emotion_classifier_pid = os.getpid()
+    return _emotion_classifier
 
-    face_detection = cv2.CascadeClassifier(detection_model_path)
-    emotion_classifier = load_model(emotion_model_path, compile=False)
-    EMOTIONS = ["angry","disgust","scared", "happy", "sad", "surprised","neutral"]
+
+def predict_emotion(img_path):
+
+    face_detection = get_face_detection()
+    emotion_classifier = get_emotion_classifier()
 
     frame = cv2.imread(img_path, 0) # 0 to read in grayscale
-    faces = face_detection.detectMultiScale(frame,scaleFactor=1.1,minNeighbors=5,minSize=(30,30),flags=cv2.CASCADE_SCALE_IMAGE)
+    with time_stage('face_detection'):
+        faces = face_detection.detectMultiScale(frame,scaleFactor=1.1,minNeighbors=5,minSize=(30,30),flags=cv2.CASCADE_SCALE_IMAGE)
 
     label = 'Face could not be detected!'
     if len(faces) > 0:
@@ -28,8 +65,13 @@ def predict_emotion(img_path):
         roi = roi.astype("float") / 255.0
         roi = img_to_array(roi)
         roi = np.expand_dims(roi, axis=0)
-        preds = emotion_classifier.predict(roi)[0]
+        with time_stage('emotion_classifier'):
+            preds = emotion_classifier.predict(roi)[0]
         label = EMOTIONS[preds.argmax()]
     
     
     return label
+
+
+if app.config['ML_PRELOAD']:
+    get_face_detection() # for the main thread, which serves the requests of sync workers
@@ -60,7 +60,7 @@ class API_Key(db.Model):
     #__tablename__ = "API_Key"
 
     id = db.Column(db.Integer, primary_key=True)
-    key = db.Column(db.String(100), nullable=False)
+    key = db.Column(db.String(100), nullable=False, index=True) # looked up on every API request
     date_created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     
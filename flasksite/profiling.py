@@ -0,0 +1,160 @@
+import cProfile
+import hmac
+import json
+import os
+import pstats
+import random
+import secrets
+import time
+from collections import Counter, defaultdict
+from flask import request, g, has_request_context
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from flasksite import app
+
+# Requests are only profiled when PROFILING_ENABLED is set; otherwise none of the hooks
+# below are registered and a request pays nothing for this module.
+PROFILE_HEADER = 'X-Profile'
+PROFILE_QUERY_ARG = 'profile'
+
+# Profiles end up on disk, so query parameters (API keys, emails, password hashes) are only
+# kept as a keyed hash: enough to tell identical queries apart, useless for recovering the values
+_PARAMETERS_KEY = secrets.token_bytes(16)
+
+
+def _is_admin():
+    flag = request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_QUERY_ARG)
+    if not flag:
+        return False
+    token = app.config['PROFILE_TOKEN']
+    if token and hmac.compare_digest(flag.encode(), token.encode()): # lets API clients without a session ask for a profile
+        return True
+    return current_user.is_authenticated and current_user.username == 'admin'
+
+
+def _should_profile():
+    rate = app.config['PROFILE_SAMPLE_RATE']
+    return (rate > 0 and random.random() < rate) or _is_admin()
+
+
+def _frame_name(func):
+    filename, lineno, name = func
+    if filename == '~': # built-ins have no source location
+        return name
+    return f'{name} ({os.path.basename(filename)}:{lineno})'
+
+
+def collapse_stats(stats, min_time=1e-6):
+    # pstats only keeps caller -> callee edges, not whole stacks, so time is spread over
+    # the possible stacks in proportion to how long each caller spent in its callee.
+    callees = defaultdict(list)
+    roots = []
+    for func, (_, _, _, _, callers) in stats.items():
+        if not callers:
+            roots.append(func)
+        for caller in callers:
+            callees[caller].append(func)
+
+    folded = defaultdict(float)
+
+    def walk(func, stack, on_stack, fraction):
+        _, _, tt, _, _ = stats[func]
+        stack = stack + [_frame_name(func)]
+        if tt * fraction >= min_time:
+            folded[';'.join(stack)] += tt * fraction
+        for callee in callees[func]:
+            if callee in on_stack: # recursion is folded into the outermost call
+                continue
+            callee_ct = stats[callee][3]
+            edge_ct = stats[callee][4][func][3]
+            if callee_ct <= 0 or edge_ct * fraction < min_time:
+                continue
+            walk(callee, stack, on_stack | {callee}, fraction * edge_ct / callee_ct)
+
+    for root in roots:
+        walk(root, [], {root}, 1.0)
+    return [f'{stack} {int(seconds * 1e6)}' for stack, seconds in folded.items() if int(seconds * 1e6) > 0]
+
+
+def find_query_problems(queries, threshold):
+    warnings = []
+    exact = Counter((q['statement'], q['parameters']) for q in queries)
+    for (statement, parameters), n in exact.items():
+        if n > 1:
+            warnings.append(f'Repeated identical query ({n}x, parameters {parameters}): {statement}')
+
+    # Same statement with different parameters, e.g. the lazy post.author loads in blog.html
+    shapes = defaultdict(set)
+    for q in queries:
+        shapes[q['statement']].add(q['parameters'])
+    for statement, parameters in shapes.items():
+        if len(parameters) >= threshold:
+            warnings.append(f'Possible N+1 ({len(parameters)} variants): {statement}')
+    return warnings
+
+
+def start_profile():
+    if not _should_profile():
+        return
+    g._profile_queries = []
+    g._profile_start = time.perf_counter()
+    g._profiler = cProfile.Profile()
+    g._profiler.enable()
+
+
+def finish_profile(response=None):
+    profiler = g.pop('_profiler', None)
+    if profiler is None:
+        return response
+    profiler.disable()
+    duration = time.perf_counter() - g.pop('_profile_start')
+    queries = g.pop('_profile_queries')
+
+    os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+    profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint or 'unmatched'}-{os.getpid()}-{random.randrange(1 << 16):04x}"
+    base = os.path.join(app.config['PROFILE_DIR'], profile_id)
+
+    with open(base + '.folded', 'w') as f:
+        f.write('\n'.join(collapse_stats(pstats.Stats(profiler).stats)) + '\n')
+
+    warnings = find_query_problems(queries, app.config['PROFILE_N_PLUS_ONE_THRESHOLD'])
+    with open(base + '.queries.json', 'w') as f:
+        json.dump({'method': request.method, 'path': request.path, 'endpoint': request.endpoint,
+                   'args': {name: '<redacted>' for name in request.args}, # ?token=... is an API key
+                   'duration': duration, 'query_count': len(queries),
+                   'query_time': sum(q['duration'] for q in queries),
+                   'warnings': warnings, 'queries': queries}, f, indent=2)
+    for warning in warnings:
+        app.logger.warning('%s %s: %s', request.method, request.path, warning)
+
+    if response is not None:
+        response.headers['X-Profile-Id'] = profile_id
+    return response
+
+
+def stop_profile_on_error(exc):
+    finish_profile() # after_request is skipped when the view raised
+
+
+def _hash_parameters(parameters):
+    return hmac.new(_PARAMETERS_KEY, repr(parameters).encode(), 'sha256').hexdigest()[:16]
+
+
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('profile_query_start', []).append(time.perf_counter())
+
+
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['profile_query_start'].pop()
+    if has_request_context() and '_profile_queries' in g:
+        g._profile_queries.append({'statement': statement, 'parameters': _hash_parameters(parameters),
+                                   'duration': elapsed})
+
+
+if app.config['PROFILING_ENABLED']:
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
+    app.teardown_request(stop_profile_on_error)
+    event.listen(Engine, 'before_cursor_execute', start_query_timer)
+    event.listen(Engine, 'after_cursor_execute', record_query)
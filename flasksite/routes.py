@@ -1,5 +1,6 @@
 import os
 import secrets
+from datetime import datetime
 from PIL import Image
 from flask import render_template, url_for, flash, redirect, request, abort, jsonify
 from flasksite import app, db, bcrypt, mail, graph, API_DOCUMENTATION_LINK
@@ -10,8 +11,12 @@ from flasksite.models import User, Post, API_Key, EmotionPrediction
 from flask_login import login_user, current_user, logout_user, login_required
 from flask_mail import Message
 from flasksite.ml_model.image import predict_emotion
-from flasksite.utils import save_picture, generate_api_key
-from flasksite.sudoku.sudoku_solver import Sudoku, preprocess_sudoku, postprocess_sudoku, validate_input
+from flasksite.utils import save_picture, generate_api_key, authenticate_api_token
+from flasksite.metrics import time_stage
+from flasksite.executors import mail_executor
+from flasksite.write_behind import write_behind
+from flasksite.sudoku.sudoku_solver import (Sudoku, preprocess_sudoku, postprocess_sudoku, validate_input,
+                                            solve_sudoku, check_position, format_solution)
 
 @app.route("/")
 def home():
@@ -164,7 +169,15 @@ def send_reset_email(user):
 
 If you did not make this request then simply ignore this email and no changes will be made.
 '''
-    mail.send(msg)
+    mail_executor.submit(send_async_email, msg) # don't hold the request while talking to the SMTP server
+
+
+def send_async_email(msg):
+    with app.app_context():
+        try:
+            mail.send(msg)
+        except Exception:
+            app.logger.exception('Could not send email to %s', msg.recipients)
 
 
 @app.route("/reset_password", methods=['GET', 'POST'])
@@ -251,36 +264,18 @@ def api_keys():
 
 @app.route("/api/posts/all", methods=['GET'])
 def api_all_posts():
-    author_id = None
-    try:
-        token = request.args['token']
-        keys = API_Key.query.all()
-        for key in keys:
-            if key.key == token:
-                author_id = int(key.user_id)
-                break
-        if not author_id:
-            return "Token is invalid"
-    except:
-        return 'You need to provide a token with a query'
+    author_id, error = authenticate_api_token(request.args.get('token'))
+    if error:
+        return error
     posts = Post.query.filter_by(user_id=author_id).all()[::-1] # reverse to show the latest post first
     response = [ ( post.title,post.date_posted.strftime("%m/%d/%Y, %H:%M:%S")+" UTC" ) for post in posts]
     return jsonify(response) if response else "You have not published any posts"
 
 @app.route("/api/posts/new", methods=['POST'])
 def api_new_post():
-    author_id = None
-    try:
-        token = request.args['token']
-        keys = API_Key.query.all()
-        for key in keys:
-            if key.key == token:
-                author_id = int(key.user_id)
-                break
-        if not author_id:
-            return "Token is invalid"
-    except:
-        return 'You need to provide a token with a query'
+    author_id, error = authenticate_api_token(request.args.get('token'))
+    if error:
+        return error
     title = request.args.get('title')
     content = request.args.get('content')
     author = User.query.filter_by(id = author_id).first()
@@ -296,18 +291,9 @@ def api_new_post():
 
 @app.route("/api/posts/last", methods=['GET'])
 def api_get_last_post():
-    author_id = None
-    try:
-        token = request.args['token']
-        keys = API_Key.query.all()
-        for key in keys:
-            if key.key == token:
-                author_id = int(key.user_id)
-                break
-        if not author_id:
-            return "Token is invalid"
-    except:
-        return 'You need to provide a token with a query'
+    author_id, error = authenticate_api_token(request.args.get('token'))
+    if error:
+        return error
     posts = Post.query.filter_by(user_id = author_id).all()
     if not posts:
         return "You haven't posted any posts!"
@@ -316,18 +302,9 @@ def api_get_last_post():
 
 @app.route("/api/posts/delete", methods=['DELETE'])
 def api_gelete_last_post():
-    author_id = None
-    try:
-        token = request.args['token']
-        keys = API_Key.query.all()
-        for key in keys:
-            if key.key == token:
-                author_id = int(key.user_id)
-                break
-        if not author_id:
-            return "Token is invalid"
-    except:
-        return 'You need to provide a token with a query'
+    author_id, error = authenticate_api_token(request.args.get('token'))
+    if error:
+        return error
     posts = Post.query.filter_by(user_id = author_id).all()
     if not posts:
         return "You haven't posted any posts!"
@@ -341,18 +318,9 @@ def api_gelete_last_post():
 
 @app.route("/api/emoclassifier", methods=['POST'])
 def emoclassifierAPI():
-    author_id = None
-    try:
-        token = request.args['token']
-        keys = API_Key.query.all()
-        for key in keys:
-            if key.key == token:
-                author_id = int(key.user_id)
-                break
-        if not author_id:
-            return "Token is invalid"
-    except:
-        return 'You need to provide a token with a query'
+    author_id, error = authenticate_api_token(request.args.get('token'))
+    if error:
+        return error
 
     try:
         image = request.files["image"]
@@ -363,10 +331,9 @@ def emoclassifierAPI():
     except:
         return "You need to attach an image with a query"
 
-    author = User.query.filter_by(id = author_id).first()
-    pic = EmotionPrediction(image_file=picture_fn, emotion_class = pred, uploader=author)
-    db.session.add(pic)
-    db.session.commit()
+    # The key already gave us the owner's id, and nothing reads the row back in this request
+    write_behind.add(EmotionPrediction, image_file=picture_fn, emotion_class=pred, user_id=author_id,
+                     date_uploaded=datetime.utcnow())
     return pred
 
 
@@ -383,7 +350,8 @@ def sudoku_solver():
         if not s.is_valid_position():
             flash('The starting position is not valid!', 'danger')
             return redirect(url_for('sudoku_solver'))
-        solution = s.solve()
+        with time_stage('sudoku_solve'):
+            solution = s.solve()
         if solution:
             flash('Your sudoku puzzle has been solved!', 'success')
             res = postprocess_sudoku(matrix) # convert back to string of length 81
@@ -402,35 +370,14 @@ def sudoku_result():
 
 @app.route("/api/solve_sudoku", methods=['POST'])
 def api_solve_sudoku():
-    author_id = None
-    try:
-        token = request.args['token']
-        keys = API_Key.query.all()
-        for key in keys:
-            if key.key == token:
-                author_id = int(key.user_id)
-                break
-        if not author_id:
-            return "Token is invalid"
-    except:
-        return 'You need to provide a token with a query'
-    try:
-        position = request.args['position']
-    except:
-        return "Query parameter must be POSITION"
-    if not validate_input(position):
-        return "Your input is not valid! Position must be strictly of size 81. Denote an empty cell as '0' or '.' , everything else as {1,2,...,9}"
-    matrix = preprocess_sudoku(position)
-    s = Sudoku(matrix)
-    if not s.is_valid_position():
-        return "The starting position is not valid!"
-    solution = s.solve()
-    if solution:
-        res = postprocess_sudoku(matrix)
-        res_formatted = ''
-        for i in range(0,len(res),9):
-            res_formatted += res[i:i+9]+'\n'
-        return f"Solution:\n {res_formatted}"
-    else:
-        return 'Your sudoku puzzle has no solution'
+    author_id, error = authenticate_api_token(request.args.get('token'))
+    if error:
+        return error
+    position = request.args.get('position')
+    error = check_position(position)
+    if error:
+        return error
+    with time_stage('sudoku_solve'):
+        res = solve_sudoku(position)
+    return format_solution(res)
     
\ No newline at end of file
@@ -16,6 +16,29 @@ def preprocess_sudoku(s): # s is a string of length 81; 0 stands for empty cell
 def postprocess_sudoku(matrix): # once solved, convert the board back into a string of length 81
     return ''.join([matrix[i][j] for i in range(9) for j in range(9)])
 
+def solve_sudoku(s): # string in, string out, so that it can be sent to a worker process; None if there is no solution
+    matrix = preprocess_sudoku(s)
+    if not Sudoku(matrix).solve():
+        return None
+    return postprocess_sudoku(matrix)
+
+def check_position(s): # error message for the API, None if the position can be handed to the solver
+    if s is None:
+        return "Query parameter must be POSITION"
+    if not validate_input(s):
+        return "Your input is not valid! Position must be strictly of size 81. Denote an empty cell as '0' or '.' , everything else as {1,2,...,9}"
+    if not Sudoku(preprocess_sudoku(s)).is_valid_position():
+        return "The starting position is not valid!"
+    return None
+
+def format_solution(res): # API response for the output of solve_sudoku
+    if not res:
+        return 'Your sudoku puzzle has no solution'
+    res_formatted = ''
+    for i in range(0,len(res),9):
+        res_formatted += res[i:i+9]+'\n'
+    return f"Solution:\n {res_formatted}"
+
 
 
 
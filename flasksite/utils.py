@@ -1,4 +1,6 @@
 from flasksite import app
+from flasksite.metrics import time_stage
+from flasksite.models import API_Key
 import os
 import secrets
 from PIL import Image
@@ -9,19 +11,30 @@ def save_picture(form_picture, folder='profile_pics'):
     picture_fn = random_hex + f_ext
     picture_path = os.path.join(app.root_path, 'static/', folder, picture_fn)
 
-    img = Image.open(form_picture)
+    with time_stage('save_picture'):
+        img = Image.open(form_picture)
 
-    # Resize while keeping the original proportion
-    width = 250
-    width_percent = (width/float(img.size[0]))
-    height_size = int((float(img.size[1])*float(width_percent)))
-    img = img.resize((width,height_size), Image.ANTIALIAS)
+        # Resize while keeping the original proportion
+        width = 250
+        width_percent = (width/float(img.size[0]))
+        height_size = int((float(img.size[1])*float(width_percent)))
+        img = img.resize((width,height_size), Image.ANTIALIAS)
 
-    img.save(picture_path)
+        img.save(picture_path)
 
     return picture_fn
 
 
 def generate_api_key():
     s = secrets.token_hex(32)
-    return s
\ No newline at end of file
+    return s
+
+
+def authenticate_api_token(token): # (owner's user id, None) or (None, error message for the API)
+    if token is None:
+        return None, 'You need to provide a token with a query'
+    with time_stage('api_key_lookup'):
+        key = API_Key.query.filter_by(key=token).first()
+    if key is None:
+        return None, 'Token is invalid'
+    return key.user_id, None
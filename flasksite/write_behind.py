@@ -0,0 +1,86 @@
+import atexit
+import os
+import threading
+from collections import defaultdict
+from flasksite import app, db
+
+
+class WriteBehindBuffer:
+    # Collects rows that nobody reads back within the same request (predictions made through
+    # the API, usage and audit records) and writes them with one bulk insert per model,
+    # when max_rows are waiting or every flush_interval seconds.
+    #
+    # mode='buffered' trades durability for throughput: rows that are still buffered when a
+    # worker is killed (SIGKILL, OOM) are lost, and a failed flush is only logged.
+    # mode='sync' inserts every row right away and a failure reaches the caller.
+
+    def __init__(self, mode='buffered', max_rows=100, flush_interval=1.0):
+        self.mode = mode
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self._rows = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+
+    def add(self, model, **values):
+        if self.mode == 'sync' or self._closed:
+            self._insert([(model, values)]) # on the caller's thread: let errors fail the request
+            return
+        with self._lock:
+            self._start_flusher()
+            self._rows.append((model, values))
+            if len(self._rows) >= self.max_rows:
+                self._wakeup.set()
+
+    def _start_flusher(self):
+        # Started on first use, and again in a forked gunicorn worker, which inherits the
+        # buffer but not the thread
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            rows, self._rows = self._rows, []
+        if rows:
+            try:
+                self._insert(rows)
+            except Exception:
+                app.logger.exception('Write-behind flush failed, %d rows were dropped', len(rows))
+
+    def _insert(self, rows):
+        by_model = defaultdict(list)
+        for model, values in rows:
+            by_model[model].append(values)
+        # A connection of its own: in sync mode (or after close) this runs on a request thread,
+        # and committing or rolling back the scoped db.session would take the request's work with it
+        with db.engine.begin() as conn:
+            for model, mappings in by_model.items():
+                conn.execute(model.__table__.insert(), mappings)
+
+    def close(self):
+        # Called on worker exit: stop the flusher and write whatever is left
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+
+write_behind = WriteBehindBuffer(mode=app.config['WRITE_BEHIND_MODE'],
+                                 max_rows=app.config['WRITE_BEHIND_MAX_ROWS'],
+                                 flush_interval=app.config['WRITE_BEHIND_FLUSH_INTERVAL'])
+atexit.register(write_behind.close)
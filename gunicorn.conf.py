@@ -0,0 +1,48 @@
+import gc
+import os
+import shutil
+import sys
+import tempfile
+
+# prometheus_client reads this when it is first imported, so it has to be set
+# in the master before the workers load the app. The directory is (re)created here
+# rather than in on_starting because with preload_app the app, and the metrics it
+# records while loading, is loaded before on_starting runs. Dropping the files of a
+# previous run keeps counters from growing across restarts.
+_multiproc_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                                       os.path.join(tempfile.gettempdir(), 'flasksite-metrics'))
+shutil.rmtree(_multiproc_dir, ignore_errors=True)
+os.makedirs(_multiproc_dir, exist_ok=True)
+
+# Imported here rather than in child_exit: that hook runs in the master's SIGCHLD handler,
+# which can fire again while the import is half done and see a partly initialised module
+from prometheus_client import multiprocess
+
+# Load the app (and with it TensorFlow and the face detector, see flasksite/ml_model/image.py)
+# once in the master, so that the workers share those pages copy-on-write
+preload_app = os.environ.get('ML_PRELOAD') == '1'
+
+
+def when_ready(server):
+    if preload_app:
+        # Keep the garbage collector from writing to the preloaded objects in the
+        # workers, which would copy their pages one by one
+        gc.freeze()
+
+
+def post_worker_init(worker):
+    # Fork the sudoku solver processes of the ASGI app before the worker starts any threads
+    if 'flasksite.asgi' in sys.modules:
+        from flasksite.executors import start_solver_executor
+        start_solver_executor()
+
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def worker_exit(server, worker):
+    # Write the rows still held by the write-behind buffer (flasksite/write_behind.py)
+    module = sys.modules.get('flasksite.write_behind')
+    if module is not None:
+        module.write_behind.close()